@@ -1,10 +1,18 @@
-
+import os
 import sys
 import re
+import time
 import json
+import math
+import argparse
+import threading
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 
 from bs4 import BeautifulSoup
+import numpy as np
 import pandas as pd
 import networkx as nx
 
@@ -25,6 +33,7 @@ import networkx as nx
 ###	map_char_combining = {} : if the text uses combining char to represent letters not existing in unicode, specify the mapping here
 ###	fixed_map = {}          : mapping of CID to unicode characters (to be avoided to do manually as much as possible, but sometimes faster and sometimes mandatorry)
 ###	target_font = None      : the font for which the recovery is made must be specified (list of possible fonts displayed when running first time on the document)
+###	reference_wordlist = None : optional path to a file of known words (or a short aligned text) of the language, enables the automatic substitution solver
 ###
 ### This script produce extensive output on stdout and several files:
 ###   <stdout>                  : contains most of the information useful to selected next char/word/line candidate to add to the input data
@@ -32,6 +41,7 @@ import networkx as nx
 ###   recovered_document.txt    : the final (or partial until recovery is not complete) document contains all the text in the document for all the fonts
 ###   document_raw.csv          : convertion of PDFMINER output to a csv file for a quick look at the structure
 ###   bigrams_graph.gexf        : the graph made from the bigrams of all the lines, in case of difficulty to determine the punctuation and characters
+###   recovery_progress.jsonl   : the progress of each session (decoded glyph tokens, words, lines and CID), to estimate the remaining effort per document
 ###
 ### These outputs must be checked to consider the best candidate of character, word or line to encode in the input data, several iteration are necessary.
 ###   It is first mandatory to correctly guess with the implemented heuristics (whose output must be checked) or fix manually in order to further proceed
@@ -49,6 +59,7 @@ def process_document_xml(xml_data):
 	soup = BeautifulSoup(xml_data, features="lxml")
 
 	map_font_alllines = {}
+	map_font_allbboxes = {}
 
 	document_lines = []
 
@@ -64,6 +75,7 @@ def process_document_xml(xml_data):
 		for idx_line, textline in enumerate(page.find_all("textline")):
 
 			map_font_line = {}
+			map_font_linebboxes = {}
 			
 			for text in textline.find_all("text"):
 
@@ -74,22 +86,30 @@ def process_document_xml(xml_data):
 
 				has_font = text.has_attr("font")
 
+				# characters without font (spaces added by pdfminer) have no geometry
+				bbox = tuple([float(x) for x in text["bbox"].split(",")]) if text.has_attr("bbox") else None
+
 				if not has_font:
 					for font in map_font_line:
 						map_font_line[font].append(char)
+						map_font_linebboxes[font].append(None)
 				else:
 
 					font = text["font"]
 
 					if font not in map_font_line:
 						map_font_line[font] = []
+						map_font_linebboxes[font] = []
 					map_font_line[font].append(char)
+					map_font_linebboxes[font].append(bbox)
 
 			for font, line in map_font_line.items():
 				if font not in map_font_alllines:
 					map_font_alllines[font] = []
+					map_font_allbboxes[font] = []
 
 				map_font_alllines[font].append(line)
+				map_font_allbboxes[font].append(map_font_linebboxes[font])
 
 				doc_line = [idx_page, idx_line, font, len(map_font_alllines[font]), len(textline), line]
 				document_lines.append(doc_line)
@@ -97,16 +117,23 @@ def process_document_xml(xml_data):
 	df_doc = pd.DataFrame(document_lines, columns=["page", "line", "font", "font_line", "len", "text"])
 	df_doc.to_csv("document_raw.csv", sep="\t", index=False)
 
-	document_data = [list_lines, document_lines, map_font_alllines]
+	document_data = [list_lines, document_lines, map_font_alllines, map_font_allbboxes]
 
 	return document_data
 
 
+def write_recovered_text(rec_text):
+	""" writes the recovered text of the target font with line numbers to help specify the information in the input data """
+
+	with open("recovered_text.txt", "w") as f:
+		print("\n".join([("l.%04d:\t" % idx)+line for idx,line in enumerate(rec_text.split("\n"))]), file=f)
+
+
 def produce_document(recovered_text, target_font, recovery_input_data, document_data):
 	""" produce the recovered document files based on the infered input data """
 
-	list_lines, document_lines, map_font_alllines = document_data
-	list_queries, map_char_combining, list_sure_words, fixed_map = recovery_input_data
+	list_lines, document_lines, map_font_alllines, map_font_allbboxes = document_data
+	list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = recovery_input_data
 
 	rec_text_lines = recovered_text.split("\n")
 
@@ -132,162 +159,185 @@ def produce_document(recovered_text, target_font, recovery_input_data, document_
 		print(rec_doc, file=f)
 
 				
-def search_inside(lines, recovery_input_data, map_cid_char=None):
-	""" performs inference using the input data """
+def parse_query(query):
+	""" splits a query into its optional line cue ("idx=>") and its text, raises a ValueError if the line cue is not a line number """
 
-	list_queries, map_char_combining, list_sure_words, fixed_map = recovery_input_data
+	if "=>" not in query:
+		return None, query
 
-	print("* SEARCH PROFILE")
+	if query.count("=>") > 1:
+		raise ValueError("the query "+repr(query)+" has several line cues")
 
-	map_cid_char = {} if map_cid_char is None else map_cid_char
-	
-	for query in list_queries:
+	line_cue, query = query.split("=>")
+	if not line_cue.strip().isdigit():
+		raise ValueError("the line cue "+repr(line_cue)+" is not a line number")
 
-		print("SEARCH", query)
+	return int(line_cue), query
 
-		if "=>" in query:
-			line_cue, query = query.split("=>")
-			line_cue = int(line_cue)
-		else:
-			line_cue = None
-		print("cue", line_cue, "query", query)
 
-		profile_query = " ".join([str(len(x)) for x in query.split()])
+def match_query(lines, query):
+	""" finds the single line matching the query (optionally prefixed by a line cue "idx=>") using the profile of the word lengths, returns the matched CID-character pairs """
 
-		print("->", ">>"+profile_query+"<<")
+	print("SEARCH", query)
 
-		maybe_matches = []
+	line_cue, query = parse_query(query)
+	print("cue", line_cue, "query", query)
 
-		for idx, line in enumerate(lines):
-			
-			profile_line = " ".join([str(len(x.split(":"))) for x in line])
-			print("line", idx, "=>", profile_line)
-
-			if profile_query in profile_line:
-				maybe_matches.append([idx, profile_line])
-
-		if line_cue is not None:
-			for idx, prof in maybe_matches:
-				print("??", idx, ">>"+prof+"<<")
-				if idx == line_cue and profile_query in prof:
-					print("FOUND LINE CUE!")
-					maybe_matches = [[idx, prof]]
-					break
-
-		if len(maybe_matches) > 1 :
-			print("TOO many matches!")
-			for idx, prof in maybe_matches:
-				print("query", profile_query)
-				print("match", idx, "=>", prof)
-
-		elif len(maybe_matches) == 1:
-			idx, prof = maybe_matches[0]
-			print("* assuming match", idx)
+	profile_query = " ".join([str(len(x)) for x in query.split()])
+
+	print("->", ">>"+profile_query+"<<")
+
+	maybe_matches = []
+
+	for idx, line in enumerate(lines):
+		
+		profile_line = " ".join([str(len(x.split(":"))) for x in line])
+		print("line", idx, "=>", profile_line)
+
+		if profile_query in profile_line:
+			maybe_matches.append([idx, profile_line])
+
+	if line_cue is not None:
+		for idx, prof in maybe_matches:
+			print("??", idx, ">>"+prof+"<<")
+			if idx == line_cue and profile_query in prof:
+				print("FOUND LINE CUE!")
+				maybe_matches = [[idx, prof]]
+				break
+
+	list_pairs = []
+
+	if len(maybe_matches) > 1 :
+		print("TOO many matches!")
+		for idx, prof in maybe_matches:
 			print("query", profile_query)
-			print("match", prof)
+			print("match", idx, "=>", prof)
 
-			line = lines[idx]
+	elif len(maybe_matches) == 1:
+		idx, prof = maybe_matches[0]
+		print("* assuming match", idx)
+		print("query", profile_query)
+		print("match", prof)
 
-			match_start = prof.index(profile_query)
-			match_end = match_start +len(profile_query)
-			
-			idx_start = prof[:match_start].count(" ")
-			idx_end = idx_start + profile_query.count(" ")+1
-
-			list_words_cid = line[idx_start:idx_end]
-			list_words_cid = [w.split(":") for w in list_words_cid]
-
-			list_words_char = query.split()
-			list_words_char = [ [x for x in w] for w in list_words_char]
-
-			print(line)
-			print(idx_start, idx_end)
-			print(match_start, match_end)
-			print(list_words_char)
-			print(list_words_cid)
-
-			for word_cid, word_char in zip(list_words_cid, list_words_char):
-				for cid, char in zip(word_cid, word_char):
-					if cid in map_cid_char:
-						if map_cid_char[cid] != char:
-							print("!!! INCONSISTENT !!!", cid, char, map_cid_char[cid])
-							lllll
-					if cid in fixed_map:
-						if fixed_map[cid] != char:
-							print("!!! INCONSISTENT WITH FIXED MAP !!!", cid, char, map_cid_char[cid])
-					print("new", cid, "->", char)
-					map_cid_char[cid] = char
+		line = lines[idx]
 
-	print(map_cid_char)
+		match_start = prof.index(profile_query)
+		match_end = match_start +len(profile_query)
+		
+		idx_start = prof[:match_start].count(" ")
+		idx_end = idx_start + profile_query.count(" ")+1
 
-	print("* EXPLOITING SURE WORD LIST")
+		list_words_cid = line[idx_start:idx_end]
+		list_words_cid = [w.split(":") for w in list_words_cid]
 
-	list_decoded_words = set()
-	map_decodedword_re = {}
-	map_decodedword_cidword = {}
+		list_words_char = query.split()
+		list_words_char = [ [x for x in w] for w in list_words_char]
 
-	for idx, line in enumerate(lines):
-		for word in line:
-			word = re.sub(r"^:", "", word) # temporary hack until, no word begins with a : because of replacement of space cid
-			rec_word = ""
-			rec_word_re = r"^"
+		print(line)
+		print(idx_start, idx_end)
+		print(match_start, match_end)
+		print(list_words_char)
+		print(list_words_cid)
+
+		for word_cid, word_char in zip(list_words_cid, list_words_char):
+			for cid, char in zip(word_cid, word_char):
+				list_pairs.append([cid, char])
+
+	return list_pairs
+
+
+def decode_word_re(word, map_cid_char):
+	""" partially decodes a word of CID, returns the decoded word and the regex matching the undecoded CID to single characters """
+
+	rec_word = ""
+	rec_word_re = r"^"
+	previous_cid = False
+	is_first = True
+	for cid in word.split(":"):
+		if cid in map_cid_char:
+			rec_word += (":" if previous_cid and not is_first else "") +map_cid_char[cid]
+			rec_word_re += map_cid_char[cid]
 			previous_cid = False
-			is_first = True
-			for cid in word.split(":"):
-				if cid in map_cid_char:
-					rec_word += (":" if previous_cid and not is_first else "") +map_cid_char[cid]
-					rec_word_re += map_cid_char[cid]
-					previous_cid = False
-				else:
-					rec_word += (":" if not is_first else "")+cid
-					rec_word_re += r"(.{1})"
-					previous_cid = True
-				is_first = False
-			rec_word_re += r"$"
-			list_decoded_words.add(rec_word)
-			map_decodedword_re[rec_word] = rec_word_re
-			map_decodedword_cidword[rec_word] = word 
+		else:
+			rec_word += (":" if not is_first else "")+cid
+			rec_word_re += r"(.{1})"
+			previous_cid = True
+		is_first = False
+	rec_word_re += r"$"
 
-	print(list_decoded_words)
+	return rec_word, rec_word_re
 
-	for sure_word in list_sure_words:
-		list_matches = [ word for word in list_decoded_words if re.search( map_decodedword_re[word], sure_word) ]
-		list_matches = [ [word,  re.search( map_decodedword_re[word], sure_word).groups() ] for word in list_decoded_words if re.search( map_decodedword_re[word], sure_word) ]
 
-		list_matches = sorted(list_matches, key=lambda x: len(x[1]), reverse=False)
+def match_sure_word(list_decoded_words, map_decodedword_re, map_decodedword_cidword, sure_word):
+	""" finds the single partially decoded word compatible with the sure word, returns the matched CID-character pairs """
+
+	list_matches = [ [word,  re.search( map_decodedword_re[word], sure_word).groups() ] for word in list_decoded_words if re.search( map_decodedword_re[word], sure_word) ]
+
+	list_matches = sorted(list_matches, key=lambda x: len(x[1]), reverse=False)
+	print(list_matches)
+
+	if len(list_matches) > 1 and len(list_matches[0][1]) < len(list_matches[1][1]):
+		print("find uniq max length match! Houray!")
+		list_matches = [list_matches[0]]
 		print(list_matches)
 
-		if len(list_matches) > 1 and len(list_matches[0][1]) < len(list_matches[1][1]):
-			print("find uniq max length match! Houray!")
-			list_matches = [list_matches[0]]
-			print(list_matches)
 
+	print("search WORD", sure_word)
 
-		print("search WORD", sure_word)
-		if len(list_matches) == 0:
-			print("no matches!")
-		elif len(list_matches) > 1:
-			print("too many matches!")
-			print(list_matches)
-		else:
-			rec_word = list_matches[0][0]
-			print("MATCH!", rec_word)
-			word_cid = map_decodedword_cidword[rec_word].split(":")
-			word_char = sure_word
-			for cid, char in zip(word_cid, word_char):
-				if cid in map_cid_char:
-					if map_cid_char[cid] != char:
-						print("!!! INCONSISTENT !!!", cid, char, map_cid_char[cid])
-				if cid in fixed_map:
-					if fixed_map[cid] != char:
-						print("!!! INCONSISTENT WITH FIXED MAP !!!", cid, char, map_cid_char[cid])
-				print("new", cid, "->", char)
-				map_cid_char[cid] = char
+	list_pairs = []
+
+	if len(list_matches) == 0:
+		print("no matches!")
+	elif len(list_matches) > 1:
+		print("too many matches!")
+		print(list_matches)
+	else:
+		rec_word = list_matches[0][0]
+		print("MATCH!", rec_word)
+		word_cid = map_decodedword_cidword[rec_word].split(":")
+		word_char = sure_word
+		for cid, char in zip(word_cid, word_char):
+			list_pairs.append([cid, char])
+
+	return list_pairs
 
 
+def search_inside(recovery_state, recovery_input_data, write_files=True):
+	""" performs inference using the input data on the recovery state, through the same updates as the watch mode and the service so that they all reach the same mapping.
+	The guesses of the automatic solver are only suggestions kept apart in the state, they are not counted as decoded """
+
+	list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = recovery_input_data
+
+	lines = recovery_state["lines"]
+	map_cid_char = recovery_state["map_cid_char"]
+
+	print("* SEARCH PROFILE")
+
+	for query in list_queries:
+		for cid, char in sorted(apply_query(recovery_state, query)[0].items()):
+			print("new", cid, "->", char)
+
+	print(map_cid_char)
+
+	print("* EXPLOITING SURE WORD LIST")
+
+	for sure_word in list_sure_words:
+		for cid, char in sorted(apply_sure_word(recovery_state, sure_word)[0].items()):
+			print("new", cid, "->", char)
 
 		print(map_cid_char)
 
+	print("* PENDING INPUTS")
+
+	# the inputs which infered nothing are tried again until no new CID is decoded
+	map_new, list_conflicts = apply_pending(recovery_state)
+	for cid, char in sorted(map_new.items()):
+		print("new", cid, "->", char)
+	for kind, input_data, cid, char, known in list_conflicts:
+		print("!!! INCONSISTENT !!!", kind, input_data, cid, char, known)
+	for kind, input_data in recovery_state["pending"]:
+		print("pending", kind, input_data)
+
 	print("GUESS CAPS")
 
 	list_fullydecoded_words = set()
@@ -354,56 +404,52 @@ def search_inside(lines, recovery_input_data, map_cid_char=None):
 
 	print(sorted(list_fullydecoded_words))
 
+	if reference_wordlist is not None:
+		print("* AUTOMATIC SUBSTITUTION SOLVER")
+
+		reference_words = load_reference_words(reference_wordlist)
+		map_solved = solve_substitution(lines, map_cid_char, fixed_map, reference_words)
+
+		map_cid_suggested = recovery_state["map_cid_suggested"]
+		map_cid_suggested.clear()
+		for cid, char in sorted(map_solved.items()):
+			print("suggested", cid, "->", char)
+			map_cid_suggested[cid] = char
+
+		print("SOLVER SUGGESTIONS")
+
+		# the suggested characters are shown between brackets, confirm them with queries or sure words
+		map_cid_shown = {cid: "["+char+"]" for cid, char in map_cid_suggested.items()}
+		map_cid_shown.update(map_cid_char)
+		for idx, line in enumerate(lines):
+			if any([cid in map_cid_suggested for word in line for cid in word.split(":")]):
+				print(idx, " ".join([decode_word(word, map_cid_shown) for word in line]))
 
 	print("RECOVERED TEXT")
 
 	print("+++++++++++++++++++++++++")
 
-	map_unreccid_line = {}
-	map_line_unreccid = {}
+	list_reclines = [line + "\n" for line in recovery_state["decoded_lines"]]
+	rec_text = "".join(list_reclines)
 
-	rec_text = ""
-
-	list_reclines = []
+	map_unreccid_line = {cid: list_idx for cid, list_idx in recovery_state["map_cid_lines"].items() if not is_decoded(recovery_state, cid)}
 
+	map_line_unreccid = {}
 	for idx, line in enumerate(lines):
-		rec_line = ""
-		list_unrec = []
-		for word in line:
-			previous_cid = False
-			for cid in word.split(":"):
-				if cid in map_cid_char:
-					rec_line += (":" if previous_cid else "") +map_cid_char[cid]
-					previous_cid = False
-				else:
-					rec_line += ":"+cid
-					previous_cid = True
-					if cid not in map_unreccid_line:
-						map_unreccid_line[cid] = []
-					map_unreccid_line[cid].append(idx)
-					list_unrec += [cid]
-
-			rec_line += " "
-		rec_line = rec_line[:-1] + "\n"
-		rec_text += rec_line
-		list_reclines.append(rec_line)
+		list_unrec = [cid for word in line for cid in word.split(":") if not is_decoded(recovery_state, cid)]
 		if len(list_unrec) > 0:
 			map_line_unreccid[idx] = list_unrec
 
-	for from_, to_ in fixed_map.items():
-		rec_text = rec_text.replace(from_, to_)
+	if write_files:
+		print(rec_text)
 
-	print(rec_text)
-					
-	with open("recovered_text.txt", "w") as f:
-		print("\n".join([("l.%04d:\t" % idx)+line for idx,line in enumerate(rec_text.split("\n"))]), file=f)
+		write_recovered_text(rec_text)
 
 	print("+++++++++++++++++++++++++")
 
 	sorted_unrec_cid = sorted(map_unreccid_line.items(), key=lambda x: len(x[1]), reverse=True)
 
 	print("REMAINING SYMBOLS TO DECODE", len(map_line_unreccid), "lines", len(sorted_unrec_cid), "cid")
-	print( len(map_cid_char) ,"done", ("%.3f" % (len(map_cid_char)/(len(map_cid_char)+len(sorted_unrec_cid))) ))
 
 	for cid, list_idxlines in sorted_unrec_cid:
 		print("* unrec cid", cid, "count:", len(list_idxlines))
@@ -423,6 +469,732 @@ def search_inside(lines, recovery_input_data, map_cid_char=None):
 	return rec_text, recovery_done
 
 
+def load_reference_words(wordlist_fp):
+	""" reads the user supplied wordlist (one or several words per line, or a short text) used to learn the character statistics of the language """
+
+	with open(wordlist_fp) as f:
+		return f.read().split()
+
+
+def build_ngram_model(reference_words, alphabet, n=3, alpha=0.1):
+	""" builds a dense table of character n-gram log probabilities over the alphabet indices, the n-gram estimates are interpolated down to the unigrams to cope with the small size of the wordlist """
+
+	size = len(alphabet)
+	map_char_idx = {char: idx for idx, char in enumerate(alphabet)}
+
+	# words are padded with the space symbol (index 0) as in the recovered text
+	stream = [0]
+	for word in reference_words:
+		stream += [map_char_idx[char] for char in word] + [0]
+	stream = np.array(stream, dtype=np.int64)
+
+	probs = np.zeros((size,)*n)
+	weights = [2**k for k in range(n)]
+	weights = [w/sum(weights) for w in weights]
+
+	for k in range(1, n+1):
+		grams = tuple(stream[i:len(stream)-k+1+i] for i in range(k))
+		count_gram = np.zeros((size,)*k)
+		np.add.at(count_gram, grams, 1)
+		# the contexts are counted from the k-grams so that each conditional distribution sums to one
+		count_context = count_gram.sum(axis=-1, keepdims=True)
+		prob_gram = (count_gram + alpha) / (count_context + alpha * size)
+		probs = probs + weights[k-1] * prob_gram.reshape((1,)*(n-k) + prob_gram.shape)
+
+	return np.log(probs)
+
+
+def _anneal_substitution(args):
+	""" one restart of the simulated annealing over the assignments of the free symbols, scores are updated with the n-grams touching the modified symbols only.
+	Each candidate character is assigned to one free symbol at most, the free symbols left over keep the unknown character """
+
+	seed, key, free_syms, candidates, unknown, grams, counts, log_probs, map_sym_grams, iterations, temperature = args
+
+	rng = np.random.default_rng(seed)
+	key = key.copy()
+
+	key[free_syms] = unknown
+	count_assigned = min(len(free_syms), len(candidates))
+	key[rng.permutation(free_syms)[:count_assigned]] = rng.permutation(candidates)[:count_assigned]
+	unused = list(set(candidates.tolist()) - set(key[free_syms].tolist()))
+
+	score_grams = lambda idx: np.dot(counts[idx], log_probs[tuple(key[grams[idx]].T)])
+
+	score = score_grams(np.arange(len(grams)))
+	best_score, best_key = score, key.copy()
+
+	for it in range(iterations):
+		temp = temperature * (0.001 ** (it / iterations))
+
+		sym_a = free_syms[rng.integers(len(free_syms))]
+		count_targets = len(unused) + (key[sym_a] != unknown)
+		if count_targets > 0 and (len(free_syms) < 2 or rng.random() < 0.5):
+			# replaces the character of the symbol with an unused one or the unknown character
+			idx_target = rng.integers(count_targets)
+			new = unused[idx_target] if idx_target < len(unused) else unknown
+			affected = map_sym_grams[sym_a]
+			old = score_grams(affected)
+			char_a = key[sym_a]
+			key[sym_a] = new
+			delta = score_grams(affected) - old
+			if not (delta >= 0 or rng.random() < math.exp(delta / temp)):
+				key[sym_a] = char_a
+				continue
+			if new == unknown:
+				unused.append(char_a)
+			elif char_a == unknown:
+				unused[idx_target] = unused[-1]
+				unused.pop()
+			else:
+				unused[idx_target] = char_a
+		elif len(free_syms) > 1:
+			sym_b = free_syms[rng.integers(len(free_syms))]
+			if key[sym_a] == key[sym_b]:
+				continue
+			affected = np.union1d(map_sym_grams[sym_a], map_sym_grams[sym_b])
+			old = score_grams(affected)
+			key[sym_a], key[sym_b] = key[sym_b], key[sym_a]
+			delta = score_grams(affected) - old
+			if not (delta >= 0 or rng.random() < math.exp(delta / temp)):
+				key[sym_a], key[sym_b] = key[sym_b], key[sym_a]
+				continue
+		else:
+			break
+
+		score += delta
+		if score > best_score:
+			best_score, best_key = score, key.copy()
+
+	return best_score, best_key
+
+
+def solve_substitution(lines, map_cid_char, fixed_map, reference_words, n=3, restarts=8, iterations=5000, temperature=10.0, processes=None, min_agreement=0.5, min_gain=1.0):
+	""" treats the corrupted font as a substitution cipher: guesses the characters of the CID not yet decoded by maximising the likelihood of the text under a character n-gram model learnt from the reference wordlist.
+	The already infered CID (map_cid_char) and the fixed_map are hard constraints, only the remaining CID are searched with several restarts of simulated annealing run in parallel.
+	A CID may stay undecoded: the n-grams touching an unknown character are scored as uniform. Only the confident guesses are returned, those found by at least min_agreement of the restarts and improving the log-likelihood by min_gain per occurrence over the unknown character """
+
+	map_known = dict(map_cid_char)
+	for cid, char in fixed_map.items():
+		map_known[str(cid).lstrip(":")] = char
+
+	list_cid = sorted(set([cid for line in lines for word in line for cid in word.split(":") if cid != ""]))
+	free_cid = [cid for cid in list_cid if cid not in map_known]
+
+	if len(free_cid) == 0 or len(reference_words) == 0:
+		return {}
+
+	alphabet = [" "] + sorted((set("".join(reference_words)) | set(map_known.values())) - set([" "]))
+	map_char_idx = {char: idx for idx, char in enumerate(alphabet)}
+
+	# symbol 0 is the word separator, the other symbols are the CID
+	map_cid_sym = {cid: idx+1 for idx, cid in enumerate(list_cid)}
+	key = np.zeros(len(list_cid)+1, dtype=np.int64)
+	for cid, char in map_known.items():
+		if cid in map_cid_sym:
+			key[map_cid_sym[cid]] = map_char_idx[char]
+
+	free_syms = np.array([map_cid_sym[cid] for cid in free_cid], dtype=np.int64)
+	candidates = np.array(sorted(set(range(1, len(alphabet))) - set(map_char_idx[char] for char in map_known.values())), dtype=np.int64)
+
+	if len(candidates) == 0:
+		print("no character left in the reference wordlist for the remaining CID")
+		return {}
+
+	stream = [0]
+	for line in lines:
+		for word in line:
+			stream += [map_cid_sym[cid] for cid in word.split(":") if cid != ""] + [0]
+	stream = np.array(stream, dtype=np.int64)
+
+	if len(stream) < n:
+		return {}
+
+	# the score only depends on the distinct n-grams of CID containing at least one free symbol
+	grams = np.stack([stream[i:len(stream)-n+1+i] for i in range(n)], axis=1)
+	grams, counts = np.unique(grams, axis=0, return_counts=True)
+	is_free = np.zeros(len(key), dtype=bool)
+	is_free[free_syms] = True
+	keep = is_free[grams].any(axis=1)
+	grams, counts = grams[keep], counts[keep].astype(float)
+
+	map_sym_grams = {sym: np.nonzero((grams == sym).any(axis=1))[0] for sym in free_syms.tolist()}
+
+	# the unknown character is the last index, any n-gram touching it gets the uniform log probability
+	unknown = len(alphabet)
+	log_probs = np.full((unknown+1,)*n, -math.log(unknown))
+	log_probs[(slice(0, unknown),)*n] = build_ngram_model(reference_words, alphabet, n)
+
+	print("solver:", len(free_cid), "free cid", len(candidates), "candidate chars", len(grams), "distinct n-grams", restarts, "restarts")
+
+	list_args = [(seed, key, free_syms, candidates, unknown, grams, counts, log_probs, map_sym_grams, iterations, temperature) for seed in range(restarts)]
+
+	with ProcessPoolExecutor(max_workers=processes) as pool:
+		results = list(pool.map(_anneal_substitution, list_args))
+
+	for idx, (score, _) in enumerate(results):
+		print("restart", idx, "score", "%.1f" % score)
+
+	best_score, best_key = max(results, key=lambda x: x[0])
+
+	map_solved = {}
+
+	for cid in free_cid:
+		sym = map_cid_sym[cid]
+		char = best_key[sym]
+		if char == unknown:
+			continue
+
+		agreement = np.mean([key_restart[sym] == char for _, key_restart in results])
+
+		# gain of the guess over leaving the CID unknown, the other guesses being fixed
+		affected = map_sym_grams[sym]
+		key_unknown = best_key.copy()
+		key_unknown[sym] = unknown
+		gain = np.dot(counts[affected], log_probs[tuple(best_key[grams[affected]].T)] - log_probs[tuple(key_unknown[grams[affected]].T)])
+		gain = gain / np.sum(stream == sym)
+
+		if agreement < min_agreement or gain < min_gain:
+			print("unsure", cid, "->", alphabet[char], "agreement", "%.2f" % agreement, "gain", "%.2f" % gain)
+			continue
+
+		map_solved[cid] = alphabet[char]
+
+	return map_solved
+
+
+def decode_word(word, map_cid_char):
+	""" decodes a word of CID as displayed in the recovered text, the undecoded CID are kept as :cid """
+
+	rec_word = ""
+	previous_cid = False
+	for cid in word.split(":"):
+		if cid in map_cid_char:
+			rec_word += (":" if previous_cid else "") +map_cid_char[cid]
+			previous_cid = False
+		else:
+			rec_word += ":"+cid
+			previous_cid = True
+
+	return rec_word
+
+
+def build_recovery_state(lines, map_cid_char, fixed_map, map_cid_sources=None, map_cid_suggested=None):
+	""" builds the in-memory indexes over the worded lines of the target font (CID to lines and words, decoded words and lines), so that new CID-character pairs only update the affected words and lines instead of rerunning the whole pipeline.
+	The sources of each CID-character pair (the input data it was infered from) are kept, so that removing an input only removes the pairs infered from it alone.
+	The suggestions of the automatic solver are kept apart, they are neither decoded nor counted in the progress until confirmed """
+
+	map_cid_sources = {} if map_cid_sources is None else map_cid_sources
+	map_cid_suggested = {} if map_cid_suggested is None else map_cid_suggested
+
+	recovery_state = {
+		"lines": lines,
+		"fixed_map": fixed_map,
+		"map_cid_char": {},
+		"map_fixed_cid": {},
+		"map_cid_sources": {},
+		"map_cid_suggested": {cid: char for cid, char in map_cid_suggested.items() if cid not in map_cid_char},
+		"pending": [],
+		"map_cid_lines": {},
+		"map_cid_words": {},
+		"map_word_decoded": {},
+		"map_word_re": {},
+		"decoded_lines": [],
+		"map_word_count": Counter([word for line in lines for word in line]),
+		"map_word_unrec": {},
+		"line_unrec": [],
+		"map_page_tokens": {},
+		"progress": {},
+	}
+
+	for idx, line in enumerate(lines):
+		for word in line:
+			for cid in word.split(":"):
+				if cid not in recovery_state["map_cid_lines"]:
+					recovery_state["map_cid_lines"][cid] = []
+					recovery_state["map_cid_words"][cid] = set()
+				recovery_state["map_cid_lines"][cid].append(idx)
+				recovery_state["map_cid_words"][cid].add(word)
+
+	recovery_state["map_fixed_cid"] = fixed_cid_chars(recovery_state)
+	recovery_state["map_cid_char"].update(map_cid_char)
+	for cid in map_cid_char:
+		recovery_state["map_cid_sources"][cid] = list(map_cid_sources.get(cid, [["search", None]]))
+
+	for word in set([word for line in lines for word in line]):
+		update_word(recovery_state, word)
+
+	recovery_state["decoded_lines"] = [decode_line(recovery_state, line) for line in lines]
+
+	init_progress(recovery_state)
+
+	return recovery_state
+
+
+def fixed_cid_chars(recovery_state):
+	""" CID decoded by the fixed map of the state, its keys being written as in the recovered text (":cid") """
+
+	map_fixed_cid = {}
+	for cid, char in recovery_state["fixed_map"].items():
+		cid = str(cid).lstrip(":")
+		if cid in recovery_state["map_cid_lines"]:
+			map_fixed_cid[cid] = char
+
+	return map_fixed_cid
+
+
+def is_decoded(recovery_state, cid):
+	""" a CID is decoded by an infered pair or by the fixed map """
+
+	return cid in recovery_state["map_cid_char"] or cid in recovery_state["map_fixed_cid"]
+
+
+def init_progress(recovery_state):
+	""" computes the progress metrics once, they are then kept up to date by update_progress as CID are decoded """
+
+	map_word_count = recovery_state["map_word_count"]
+
+	count_unrec = lambda cids: len(set([cid for cid in cids if not is_decoded(recovery_state, cid)]))
+
+	recovery_state["map_word_unrec"] = {word: count_unrec(word.split(":")) for word in map_word_count}
+	recovery_state["line_unrec"] = [count_unrec([cid for word in line for cid in word.split(":")]) for line in recovery_state["lines"]]
+
+	map_word_unrec = recovery_state["map_word_unrec"]
+	tokens = sum([len(list_idx) for list_idx in recovery_state["map_cid_lines"].values()])
+
+	recovery_state["progress"] = {
+		"tokens": tokens,
+		"tokens_decoded": sum([len(list_idx) for cid, list_idx in recovery_state["map_cid_lines"].items() if is_decoded(recovery_state, cid)]),
+		"words": sum(map_word_count.values()),
+		"words_decoded": sum([count for word, count in map_word_count.items() if map_word_unrec[word] == 0]),
+		"lines": len(recovery_state["lines"]),
+		"lines_decoded": recovery_state["line_unrec"].count(0),
+	}
+
+
+def init_page_progress(recovery_state):
+	""" computes the decoded and total glyph tokens of each page, once the pages of the lines are known """
+
+	map_page_tokens = {}
+
+	for idx, line in enumerate(recovery_state["lines"]):
+		page = recovery_state["line_pages"][idx]
+		if page not in map_page_tokens:
+			map_page_tokens[page] = [0, 0]
+		for word in line:
+			for cid in word.split(":"):
+				map_page_tokens[page][0] += is_decoded(recovery_state, cid)
+				map_page_tokens[page][1] += 1
+
+	recovery_state["map_page_tokens"] = map_page_tokens
+
+
+def update_progress(recovery_state, cid, decoded):
+	""" updates the progress metrics when a CID gets decoded (or undecoded when its input is removed), only the words, lines and pages containing the CID are visited """
+
+	progress = recovery_state["progress"]
+	map_word_unrec = recovery_state["map_word_unrec"]
+	line_unrec = recovery_state["line_unrec"]
+
+	step = 1 if decoded else -1
+	list_idx = recovery_state["map_cid_lines"].get(cid, [])
+
+	progress["tokens_decoded"] += step * len(list_idx)
+
+	for word in recovery_state["map_cid_words"].get(cid, []):
+		map_word_unrec[word] -= step
+		if map_word_unrec[word] == (0 if decoded else 1):
+			progress["words_decoded"] += step * recovery_state["map_word_count"][word]
+
+	for idx in set(list_idx):
+		line_unrec[idx] -= step
+		if line_unrec[idx] == (0 if decoded else 1):
+			progress["lines_decoded"] += step
+
+	if len(recovery_state["map_page_tokens"]) > 0:
+		for idx in list_idx:
+			recovery_state["map_page_tokens"][recovery_state["line_pages"][idx]][0] += step
+
+
+def update_word(recovery_state, word):
+	""" refreshes the decoded word cache for a word of CID """
+
+	map_cid_char = recovery_state["map_cid_char"]
+
+	recovery_state["map_word_decoded"][word] = decode_word(word, map_cid_char)
+	recovery_state["map_word_re"][word] = decode_word_re(re.sub(r"^:", "", word), map_cid_char)
+
+
+def decode_line(recovery_state, line):
+	""" decodes a line from the decoded word cache, applying the fixed map """
+
+	rec_line = " ".join([recovery_state["map_word_decoded"][word] for word in line])
+
+	for from_, to_ in recovery_state["fixed_map"].items():
+		rec_line = rec_line.replace(from_, to_)
+
+	return rec_line
+
+
+def add_cid_char(recovery_state, cid, char, source):
+	""" adds a CID-character pair to the state, only the words and lines containing the CID are decoded again """
+
+	recovery_state["map_cid_char"][cid] = char
+	recovery_state["map_cid_sources"][cid] = [source]
+	# a confirmed pair overrides the suggestion of the solver
+	recovery_state["map_cid_suggested"].pop(cid, None)
+
+	update_cid(recovery_state, cid)
+	if cid not in recovery_state["map_fixed_cid"]:
+		update_progress(recovery_state, cid, True)
+
+
+def remove_cid_char(recovery_state, cid):
+	""" removes a CID-character pair from the state, only the words and lines containing the CID are decoded again """
+
+	del recovery_state["map_cid_char"][cid]
+	del recovery_state["map_cid_sources"][cid]
+
+	update_cid(recovery_state, cid)
+	if cid not in recovery_state["map_fixed_cid"]:
+		update_progress(recovery_state, cid, False)
+
+
+def update_cid(recovery_state, cid):
+	""" refreshes the decoded words and lines containing the CID """
+
+	for word in recovery_state["map_cid_words"].get(cid, []):
+		update_word(recovery_state, word)
+
+	lines = recovery_state["lines"]
+	for idx in sorted(set(recovery_state["map_cid_lines"].get(cid, []))):
+		recovery_state["decoded_lines"][idx] = decode_line(recovery_state, lines[idx])
+
+
+def check_cid_chars(recovery_state, list_pairs):
+	""" lists the pairs inconsistent with the current mapping or the fixed map """
+
+	map_cid_char = recovery_state["map_cid_char"]
+	map_fixed_cid = recovery_state["map_fixed_cid"]
+
+	list_conflicts = []
+	for cid, char in list_pairs:
+		if cid in map_cid_char and map_cid_char[cid] != char:
+			list_conflicts.append([cid, char, map_cid_char[cid]])
+		elif cid in map_fixed_cid and map_fixed_cid[cid] != char:
+			list_conflicts.append([cid, char, map_fixed_cid[cid]])
+
+	return list_conflicts
+
+
+def apply_cid_chars(recovery_state, list_pairs, source):
+	""" adds the pairs infered from the source to the state unless one of them is inconsistent, returns the newly decoded CID and the conflicts.
+	A source infering no pair or an inconsistent one is kept pending, to be tried again by apply_pending """
+
+	list_conflicts = check_cid_chars(recovery_state, list_pairs)
+
+	pending = recovery_state["pending"]
+	if len(list_pairs) == 0 or len(list_conflicts) > 0:
+		if source not in pending:
+			pending.append(source)
+	elif source in pending:
+		pending.remove(source)
+
+	map_new = {}
+	if len(list_conflicts) == 0:
+		for cid, char in list_pairs:
+			if cid not in recovery_state["map_cid_char"]:
+				map_new[cid] = char
+				add_cid_char(recovery_state, cid, char, source)
+			elif source not in recovery_state["map_cid_sources"][cid]:
+				recovery_state["map_cid_sources"][cid].append(source)
+
+	return map_new, list_conflicts
+
+
+def remove_source(recovery_state, source):
+	""" removes an input from the state, the pairs still infered from another input are kept, returns the removed pairs """
+
+	if source in recovery_state["pending"]:
+		recovery_state["pending"].remove(source)
+
+	map_removed = {}
+	for cid, list_sources in list(recovery_state["map_cid_sources"].items()):
+		if source in list_sources:
+			list_sources.remove(source)
+			if len(list_sources) == 0:
+				map_removed[cid] = recovery_state["map_cid_char"][cid]
+				remove_cid_char(recovery_state, cid)
+
+	return map_removed
+
+
+def set_fixed_map(recovery_state, fixed_map):
+	""" replaces the fixed map of the state, as it applies on the decoded text all the lines are decoded again from the word cache and the progress metrics are computed again """
+
+	recovery_state["fixed_map"] = fixed_map
+	recovery_state["map_fixed_cid"] = fixed_cid_chars(recovery_state)
+
+	lines = recovery_state["lines"]
+	recovery_state["decoded_lines"] = [decode_line(recovery_state, line) for line in lines]
+
+	init_progress(recovery_state)
+	if "line_pages" in recovery_state:
+		init_page_progress(recovery_state)
+
+
+def apply_query(recovery_state, query):
+	""" performs inference from a single query on the state, a query with an invalid line cue (e.g. being typed in the watched file) infers nothing and is kept pending """
+
+	try:
+		list_pairs = match_query(recovery_state["lines"], query)
+	except ValueError as e:
+		print("!!! INVALID QUERY !!!", query, e)
+		list_pairs = []
+
+	return apply_cid_chars(recovery_state, list_pairs, ["query", query])
+
+
+def apply_sure_word(recovery_state, sure_word):
+	""" performs inference from a single sure word on the state, the partially decoded words come from the decoded word cache """
+
+	list_decoded_words = set()
+	map_decodedword_re = {}
+	map_decodedword_cidword = {}
+
+	for word, (rec_word, rec_word_re) in recovery_state["map_word_re"].items():
+		list_decoded_words.add(rec_word)
+		map_decodedword_re[rec_word] = rec_word_re
+		map_decodedword_cidword[rec_word] = re.sub(r"^:", "", word)
+
+	return apply_cid_chars(recovery_state, match_sure_word(list_decoded_words, map_decodedword_re, map_decodedword_cidword, sure_word), ["sure_word", sure_word])
+
+
+def apply_input(recovery_state, source):
+	""" performs inference from a ["query", query] or ["sure_word", sure_word] source on the state """
+
+	kind, input_data = source
+	if kind == "query":
+		return apply_query(recovery_state, input_data)
+	return apply_sure_word(recovery_state, input_data)
+
+
+def apply_pending(recovery_state):
+	""" tries the pending inputs again until no new CID is decoded, as each decoded CID may disambiguate the matches of another input or resolve its conflicts, so that the state does not depend on the order the inputs were added in.
+	Returns the newly decoded CID and the conflicts of the inputs still pending """
+
+	map_new = {}
+
+	while True:
+		count_new = len(map_new)
+		list_conflicts = []
+		for source in list(recovery_state["pending"]):
+			map_source_new, conflicts = apply_input(recovery_state, source)
+			map_new.update(map_source_new)
+			list_conflicts += [source + conflict for conflict in conflicts]
+		if len(map_new) == count_new:
+			break
+
+	return map_new, list_conflicts
+
+
+def recovery_stats(recovery_state):
+	""" statistics on the remaining CID to decode, as displayed at the end of the recovered text """
+
+	map_unreccid_line = {cid: list_idx for cid, list_idx in recovery_state["map_cid_lines"].items() if not is_decoded(recovery_state, cid)}
+	sorted_unrec_cid = sorted(map_unreccid_line.items(), key=lambda x: len(x[1]), reverse=True)
+	count_decoded = len(recovery_state["map_cid_lines"]) - len(map_unreccid_line)
+
+	progress = recovery_state["progress"]
+
+	stats = {
+		"lines": progress["lines"],
+		"remaining_lines": progress["lines"] - progress["lines_decoded"],
+		"decoded_cid": count_decoded,
+		"remaining_cid": [{"cid": cid, "count": len(list_idx), "lines": sorted(set(list_idx))[:3]} for cid, list_idx in sorted_unrec_cid],
+		"ratio": count_decoded/len(recovery_state["map_cid_lines"]) if len(recovery_state["map_cid_lines"]) > 0 else 1.,
+	}
+
+	return stats
+
+
+def recovery_progress(recovery_state):
+	""" structured summary of the progress metrics: share of the glyph tokens decoded, of the fully decoded words (counted with their occurrences) and lines, of the distinct CID and coverage of each page """
+
+	progress = recovery_state["progress"]
+
+	ratio = lambda done, tot: done/tot if tot > 0 else 1.
+
+	count_cid = len(recovery_state["map_cid_lines"])
+	count_decoded_cid = len([cid for cid in recovery_state["map_cid_lines"] if is_decoded(recovery_state, cid)])
+
+	summary = {
+		"tokens": progress["tokens"],
+		"tokens_decoded": progress["tokens_decoded"],
+		"token_ratio": ratio(progress["tokens_decoded"], progress["tokens"]),
+		"words": progress["words"],
+		"words_decoded": progress["words_decoded"],
+		"word_ratio": ratio(progress["words_decoded"], progress["words"]),
+		"lines": progress["lines"],
+		"lines_decoded": progress["lines_decoded"],
+		"line_ratio": ratio(progress["lines_decoded"], progress["lines"]),
+		"cid": count_cid,
+		"cid_decoded": count_decoded_cid,
+		"cid_ratio": ratio(count_decoded_cid, count_cid),
+		"pages": {page: ratio(decoded, total) for page, (decoded, total) in sorted(recovery_state["map_page_tokens"].items())},
+	}
+
+	return summary
+
+
+def record_progress(summary, document_fp, target_font, session=None, progress_fp="recovery_progress.jsonl"):
+	""" appends the progress of the session to the time series of the document, returns all the records of the document and font.
+	A session (identified by its start time) has a single record: recording it again, e.g. after each change in watch mode, replaces its previous record """
+
+	record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "document": os.path.basename(document_fp), "font": target_font}
+	record["session"] = record["time"] if session is None else session
+	record.update({key: value for key, value in summary.items() if key != "pages"})
+
+	list_lines = []
+	list_records = []
+	idx_last = None
+	if os.path.exists(progress_fp):
+		with open(progress_fp) as f:
+			list_lines = f.readlines()
+		for idx, line in enumerate(list_lines):
+			previous = json.loads(line)
+			if previous["document"] == record["document"] and previous["font"] == target_font:
+				list_records.append(previous)
+				idx_last = idx
+
+	if idx_last is not None and list_records[-1].get("session") == record["session"]:
+		list_lines[idx_last] = json.dumps(record, ensure_ascii=False) + "\n"
+		list_records.pop()
+		with open(progress_fp, "w") as f:
+			f.writelines(list_lines)
+	else:
+		with open(progress_fp, "a") as f:
+			print(json.dumps(record, ensure_ascii=False), file=f)
+
+	return list_records + [record]
+
+
+def estimate_remaining(list_records):
+	""" estimates the number of sessions still needed from the mean gain of decoded tokens per session, None if there is no gain yet """
+
+	if len(list_records) < 2:
+		return None
+
+	gain = (list_records[-1]["token_ratio"] - list_records[0]["token_ratio"]) / (len(list_records) - 1)
+
+	if gain <= 0:
+		return None
+
+	return (1. - list_records[-1]["token_ratio"]) / gain
+
+
+def print_progress(summary, list_records):
+	""" prints the progress summary and the estimate of the remaining effort """
+
+	print("PROGRESS")
+	print("tokens", summary["tokens_decoded"], "/", summary["tokens"], ("%.3f" % summary["token_ratio"]))
+	print("words", summary["words_decoded"], "/", summary["words"], ("%.3f" % summary["word_ratio"]))
+	print("lines", summary["lines_decoded"], "/", summary["lines"], ("%.3f" % summary["line_ratio"]))
+	print("cid", summary["cid_decoded"], "/", summary["cid"], ("%.3f" % summary["cid_ratio"]))
+
+	list_pages = sorted([[ratio, page] for page, ratio in summary["pages"].items() if ratio < 1.])
+	print("pages not fully decoded", len(list_pages), "/", len(summary["pages"]))
+	print("least decoded pages", " ".join([("p.%04d:%.3f" % (page, ratio)) for ratio, page in list_pages[:10]]))
+
+	remaining = estimate_remaining(list_records)
+	print("sessions", len(list_records), "estimated remaining sessions", "?" if remaining is None else ("%.1f" % remaining))
+
+
+def render_lines(recovery_state, start, end):
+	""" renders a range of lines of the recovered text, as in recovered_text.txt """
+
+	decoded_lines = recovery_state["decoded_lines"]
+
+	return [("l.%04d:\t" % idx)+decoded_lines[idx] for idx in range(max(start, 0), min(end, len(decoded_lines)))]
+
+
+def index_document(recovery_state, document_data, target_font):
+	""" builds the line offset index of the document: range of document lines of each page and line of the recovered text of each document line of the target font """
+
+	list_lines, document_lines, map_font_alllines, map_font_allbboxes = document_data
+
+	map_page_doclines = {}
+	map_docline_line = {}
+	line_pages = []
+
+	for idx_doc, (page, line, font, font_line, len_, text) in enumerate(document_lines):
+		if page not in map_page_doclines:
+			map_page_doclines[page] = [idx_doc, idx_doc]
+		map_page_doclines[page][1] = idx_doc + 1
+
+		if font == target_font:
+			map_docline_line[idx_doc] = font_line - 1
+			line_pages.append(page)
+
+	recovery_state["document_lines"] = document_lines
+	recovery_state["map_page_doclines"] = map_page_doclines
+	recovery_state["map_docline_line"] = map_docline_line
+	recovery_state["line_pages"] = line_pages
+
+	init_page_progress(recovery_state)
+
+
+def clamp_pages(recovery_state, start, end):
+	""" restricts a range of pages to the pages of the document """
+
+	count_pages = max(recovery_state["map_page_doclines"]) + 1 if len(recovery_state["map_page_doclines"]) > 0 else 0
+	start = min(max(start, 0), count_pages)
+
+	return start, max(start, min(end, count_pages))
+
+
+def render_pages(recovery_state, start, end, map_char_combining):
+	""" renders a range of pages of the recovered document, the lines of the target font are numbered as in recovered_text.txt """
+
+	document_lines = recovery_state["document_lines"]
+	decoded_lines = recovery_state["decoded_lines"]
+	map_docline_line = recovery_state["map_docline_line"]
+
+	list_rendered = []
+
+	for page in range(*clamp_pages(recovery_state, start, end)):
+		if page not in recovery_state["map_page_doclines"]:
+			continue
+
+		first, last = recovery_state["map_page_doclines"][page]
+
+		for idx_doc in range(first, last):
+			if idx_doc in map_docline_line:
+				idx = map_docline_line[idx_doc]
+				rec_line = ("l.%04d:\t" % idx) + decoded_lines[idx]
+			else:
+				rec_line = "\t" + "".join(document_lines[idx_doc][5])
+
+			for from_, to_ in map_char_combining.items():
+				rec_line = rec_line.replace(from_, to_)
+
+			list_rendered.append(("p.%04d\t" % page) + rec_line)
+
+	return list_rendered
+
+
+def print_ranges(recovery_state, recovery_input_data, line_range=None, page_range=None):
+	""" prints the requested line and page ranges of the recovery """
+
+	if line_range is not None:
+		print("RECOVERED LINES", line_range[0], "to", line_range[1]-1)
+		print("\n".join(render_lines(recovery_state, *line_range)))
+
+	if page_range is not None:
+		start, end = clamp_pages(recovery_state, *page_range)
+		print("RECOVERED PAGES", start, "to", end-1)
+		print("\n".join(render_pages(recovery_state, start, end, recovery_input_data[1])))
+
+
 def guess_words(all_lines_str, dotspace):
 	""" for interactive searching of the right encoding for dot and space characters in order to properly separate word, mandatory for the rest of the procedure to unfold corectly.
 	To this aim, this function displays statistics on word lengths assuming the characters specified in parameters. It is up to the user to either rely on automatic guessing, and in case of faillure to either improve it ;) or to manually guess them with the availlable info (mostly the graph, the CSV and the lenght histogram)"""
@@ -599,15 +1371,61 @@ def recover_punctuation(all_lines_str, count_all, count_last, count_start, count
 	return maybe_dotspace
 
 
-def process_font_allcid(target_font, recovery_input_data, document_data, all_lines, keep_punctuation):
+def layout_words(line, bboxes, min_jump=0.1):
+	""" splits a line into words using the geometry of the glyphs: the glyphs are ordered along the line, and the word boundaries are the gaps above the first large jump of the sorted gaps of the line, so that the threshold follows the spacing of each line.
+	A jump is large when it exceeds a fraction of the median glyph height, a line without such jump is a single word. The glyphs overlapping their neighbour (e.g. a combining mark moved back over its base) count as touching.
+	The characters without geometry (spaces added by pdfminer) are dropped """
+
+	list_chars = [char for char, bbox in zip(line, bboxes) if bbox is not None]
+	boxes = np.array([bbox for bbox in bboxes if bbox is not None], dtype=float).reshape(-1, 4)
+
+	if len(list_chars) == 0:
+		return []
+
+	# glyphs emitted out of order are put back in reading order
+	order = np.argsort(boxes[:, 0], kind="stable")
+	boxes = boxes[order]
+	list_chars = [list_chars[idx] for idx in order]
+
+	gaps = np.maximum(boxes[1:, 0] - boxes[:-1, 2], 0.)
+	height = np.median(boxes[:, 3] - boxes[:, 1])
+
+	# touching glyphs (a zero gap) are the reference of the gaps inside the words, so that a line where all the gaps are word boundaries is still split
+	sorted_gaps = np.sort(np.append(gaps, 0.))
+	jumps = np.diff(sorted_gaps)
+	list_large = np.nonzero(jumps > min_jump * height)[0]
+
+	if len(list_large) == 0:
+		return [list_chars]
+
+	threshold = (sorted_gaps[list_large[0]] + sorted_gaps[list_large[0]+1]) / 2
+	list_bounds = (np.nonzero(gaps > threshold)[0] + 1).tolist()
+
+	return [list_chars[start:end] for start, end in zip([0] + list_bounds, list_bounds + [len(list_chars)])]
+
+
+def process_font_allcid(target_font, recovery_input_data, document_data, all_lines, keep_punctuation, write_files=True, use_layout=False, map_cid_original=None, map_original_char=None):
 	""" apply knows rule to text and infers new CID-character pairs """
 	
-	list_queries, map_char_combining, list_sure_words, fixed_map = recovery_input_data
+	list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = recovery_input_data
+	list_lines, document_lines, map_font_alllines, map_font_allbboxes = document_data
 
 	print("PROCESS ALL CID")
 
 	all_lines = [ [re.sub(r"[^0-9]", "", x) for x in line] for line in all_lines]
 
+	if use_layout:
+		# the words are separated using the geometry of the glyphs instead of guessing the space CID
+		all_words = [layout_words(line, bboxes) for line, bboxes in zip(all_lines, map_font_allbboxes[target_font])]
+		all_lines = [ [cid for word in words for cid in word] for words in all_words]
+
+		# an emitted space glyph has a box filling the gap between the words, the lines are then hardly split and the guessed space CID separates the words instead
+		count_split = sum([len(words) > 1 for words in all_words])
+		count_long = sum([len(line) >= 8 for line in all_lines])
+		if count_split < 0.5 * count_long:
+			print("WARNING: no gap between most words,", count_split, "split lines out of", count_long, ": the space glyph is emitted, the words are separated by the guessed space CID")
+			use_layout = False
+
 	count_cid = Counter()
 	count_last = Counter()
 	count_start = Counter()
@@ -638,7 +1456,9 @@ def process_font_allcid(target_font, recovery_input_data, document_data, all_lin
 		dot, space = dotspace.split(":")
 
 		text = all_lines_str
-		if not keep_punctuation:
+		if use_layout:
+			text = "\n".join([ " ".join([":".join(word) for word in words]) for words in all_words])
+		elif not keep_punctuation:
 			text = re.sub(r"(:|\b)"+space+r"(:|\b)", " ", text)
 		else:
 			pass
@@ -647,11 +1467,31 @@ def process_font_allcid(target_font, recovery_input_data, document_data, all_lin
 
 		map_cid_char = {}
 		map_cid_char[dot] = "."
+		map_cid_sources = {dot: [["punctuation", None]]}
+
+		map_cid_original = {} if map_cid_original is None else map_cid_original
+		map_original_char = {} if map_original_char is None else map_original_char
+
+		# the mapping exported by a previous run is the starting point, the space being the word separator
+		for cid, original in map_cid_original.items():
+			if original in map_original_char and cid != dot and map_original_char[original] != " ":
+				map_cid_char[cid] = map_original_char[original]
+				map_cid_sources[cid] = [["export", None]]
 
 		all_lines_worded = [ line.split() for line in text.split("\n")]
-		recovered_text, status = search_inside(all_lines_worded, recovery_input_data, map_cid_char)
 
-		produce_document(recovered_text, target_font, recovery_input_data, document_data)
+		recovery_state = build_recovery_state(all_lines_worded, map_cid_char, fixed_map, map_cid_sources)
+		recovery_state["map_cid_original"] = map_cid_original
+		index_document(recovery_state, document_data, target_font)
+
+		# the space CID is consumed as the word separator, it is kept for the export unless the words come from the layout
+		if not use_layout and not keep_punctuation:
+			recovery_state["space_cid"] = [space, count_cid[space]]
+
+		recovered_text, status = search_inside(recovery_state, recovery_input_data, write_files)
+
+		if write_files:
+			produce_document(recovered_text, target_font, recovery_input_data, document_data)
 
 	print()
 	print("********")
@@ -673,7 +1513,7 @@ def process_font_allcid(target_font, recovery_input_data, document_data, all_lin
 	print(count_cidline.most_common())
 	print("lines", len(all_lines))
 
-	return status
+	return status, recovery_state
 
 
 def remap_cid(list_cid, keep_punctuation=False):
@@ -686,9 +1526,9 @@ def remap_cid(list_cid, keep_punctuation=False):
 			map_old_new[old] = new
 	return map_old_new
 
-def process_font(target_font, recovery_input_data, document_data, force_cid=False, keep_punctuation=False):
+def process_font(target_font, recovery_input_data, document_data, force_cid=False, keep_punctuation=False, write_files=True, use_layout=False, map_original_char=None):
 
-	list_lines, document_lines, map_font_alllines = document_data
+	list_lines, document_lines, map_font_alllines, map_font_allbboxes = document_data
 	
 	all_lines = map_font_alllines[target_font]
 
@@ -703,6 +1543,8 @@ def process_font(target_font, recovery_input_data, document_data, force_cid=Fals
 
 	most_cid = count_cid > 1/3. * count_tot
 
+	map_cid_original = {}
+
 	if force_cid:
 		print("FORCE CONVERTION TO CID")
 
@@ -719,26 +1561,442 @@ def process_font(target_font, recovery_input_data, document_data, force_cid=Fals
 		all_lines = [ [convert[old] for old in line] for line in all_lines]
 		map_font_alllines[target_font] = all_lines
 
+		map_cid_original = {re.sub(r"[^0-9]", "", new): old for old, new in convert.items() if old != new}
+
 	all_cid = all(["cid" in char for line in map_font_alllines[target_font] for char in line])
 		
 	if all_cid or force_cid:
 		print(json.dumps(map_font_alllines[target_font], indent=4))
-		status = process_font_allcid(target_font, recovery_input_data, document_data, map_font_alllines[target_font], keep_punctuation)
+		status, recovery_state = process_font_allcid(target_font, recovery_input_data, document_data, map_font_alllines[target_font], keep_punctuation, write_files, use_layout, map_cid_original, map_original_char)
+
+	return status, recovery_state
+
+def load_recovery_input(input_fp):
+	""" reads the recovery input data from a JSON file holding the same fields as the variables of the main function, missing fields take their default value """
+
+	with open(input_fp) as f:
+		data = json.load(f)
+
+	list_queries = data.get("list_queries", [])
+	map_char_combining = data.get("map_char_combining", {})
+	list_sure_words = data.get("list_sure_words", [])
+	fixed_map = data.get("fixed_map", {})
+	reference_wordlist = data.get("reference_wordlist", None)
+	target_font = data.get("target_font", None)
+
+	recovery_input_data = [list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist]
+
+	return recovery_input_data, target_font
+
+
+def update_recovery(recovery_state, recovery_input_data, new_recovery_input_data):
+	""" applies only the input data added or removed since the previous version to the state, returns the changes for the delta report """
+
+	list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = recovery_input_data
+	new_list_queries, new_map_char_combining, new_list_sure_words, new_fixed_map, new_reference_wordlist = new_recovery_input_data
+
+	map_before = dict(recovery_state["map_cid_char"])
+
+	for query in list_queries:
+		if query not in new_list_queries:
+			print("removed query", query)
+			remove_source(recovery_state, ["query", query])
+	for sure_word in list_sure_words:
+		if sure_word not in new_list_sure_words:
+			print("removed sure word", sure_word)
+			remove_source(recovery_state, ["sure_word", sure_word])
+
+	if new_fixed_map != fixed_map:
+		print("updated fixed map", new_fixed_map)
+		set_fixed_map(recovery_state, new_fixed_map)
+
+	for query in new_list_queries:
+		if query not in list_queries:
+			print("added query", query)
+			apply_query(recovery_state, query)
+	for sure_word in new_list_sure_words:
+		if sure_word not in list_sure_words:
+			print("added sure word", sure_word)
+			apply_sure_word(recovery_state, sure_word)
+
+	# the inputs which infered nothing so far are tried again with the new state, the conflicts are those of the inputs left pending
+	map_new, list_conflicts = apply_pending(recovery_state)
+
+	if new_reference_wordlist != reference_wordlist:
+		print("WARNING: the reference wordlist is not used in watch mode, rerun the script to use the automatic solver")
+
+	for kind, input_data in recovery_state["pending"]:
+		print("pending", kind, input_data)
+
+	map_after = recovery_state["map_cid_char"]
+	map_added = {cid: char for cid, char in map_after.items() if map_before.get(cid) != char}
+	map_removed = {cid: char for cid, char in map_before.items() if cid not in map_after}
+
+	return map_added, map_removed, list_conflicts
+
+
+def write_recovery(recovery_state, target_font, recovery_input_data, document_data):
+	""" regenerates recovered_text.txt and recovered_document.txt from the decoded lines of the state """
+
+	rec_text = "".join([line + "\n" for line in recovery_state["decoded_lines"]])
+
+	write_recovered_text(rec_text)
+	produce_document(rec_text, target_font, recovery_input_data, document_data)
+
+
+def watch_recovery(input_fp, recovery_state, recovery_input_data, target_font, document_fp, document_data, write_files=True, line_range=None, page_range=None, interval=1., session=None):
+	""" watches the recovery input file, on each change the added or removed input data are applied to the warm state, the recovered files (or only the requested ranges) are regenerated and a short delta report is printed.
+	The solver is not run again, its suggestions from the first run are kept and listed in the delta report until confirmed. The progress record of the session is updated after each change """
+
+	# the state of the first run already knows the source of every pair, the first report only shows the progress
+	map_added, map_removed, list_conflicts = {}, {}, []
+
+	last_mtime = None
+
+	while True:
+		try:
+			mtime = os.stat(input_fp).st_mtime
+		except OSError:
+			mtime = last_mtime
+
+		if last_mtime is not None and mtime != last_mtime:
+			try:
+				new_recovery_input_data, new_target_font = load_recovery_input(input_fp)
+			except (OSError, ValueError) as e:
+				print("ERROR: can not read the input file", input_fp, e)
+				last_mtime = mtime
+				continue
+
+			if new_target_font != target_font:
+				print("WARNING: the target font changed, restart the watch to recover", new_target_font)
+				last_mtime = mtime
+				continue
+
+			print("==== WATCH: input file changed")
+			map_added, map_removed, list_conflicts = update_recovery(recovery_state, recovery_input_data, new_recovery_input_data)
+			recovery_input_data[:] = new_recovery_input_data
+
+		if mtime != last_mtime:
+			if write_files:
+				write_recovery(recovery_state, target_font, recovery_input_data, document_data)
+			print_ranges(recovery_state, recovery_input_data, line_range, page_range)
+
+			print("==== DELTA REPORT")
+			for cid, char in sorted(map_added.items()):
+				print("new", cid, "->", char)
+			for cid, char in sorted(map_removed.items()):
+				print("removed", cid, "->", char)
+			for kind, input_data, cid, char, known in list_conflicts:
+				print("!!! INCONSISTENT !!!", kind, input_data, cid, char, known)
+			for cid, char in sorted(recovery_state["map_cid_suggested"].items()):
+				print("suggested", cid, "->", char, "(solver of the first run)")
+
+			stats = recovery_stats(recovery_state)
+			print("REMAINING SYMBOLS TO DECODE", stats["remaining_lines"], "lines", len(stats["remaining_cid"]), "cid")
+
+			summary = recovery_progress(recovery_state)
+			print_progress(summary, record_progress(summary, document_fp, target_font, session))
+
+			last_mtime = mtime
+
+		time.sleep(interval)
+
+
+class RecoveryRequestHandler(BaseHTTPRequestHandler):
+	""" JSON endpoints of the recovery service, the answers come from the in-memory recovery state held by the server and the updates are serialised by its lock
+
+	GET  /stats                  : remaining CID statistics
+	GET  /progress               : progress metrics (decoded tokens, words, lines, CID and page coverage)
+	GET  /lines?start=..&end=..  : decoded line range, as in recovered_text.txt
+	GET  /pages?start=..&end=..  : decoded page range of the whole document
+	GET  /mapping                : current CID to character mapping
+	GET  /input                  : queries and sure words accepted so far, and the pending ones which infered nothing yet
+	POST /queries                : {"queries": [...]}, same syntax as list_queries
+	POST /sure_words             : {"sure_words": [...]}, same syntax as list_sure_words
+	POST /write                  : regenerates recovered_text.txt and recovered_document.txt
+	"""
+
+	def send_json(self, data, code=200):
+		body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		params = parse_qs(url.query)
+
+		recovery_state = self.server.recovery_state
+		list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = self.server.recovery_input_data
+
+		try:
+			start = int(params.get("start", ["0"])[0])
+			end = int(params.get("end", [str(start+50)])[0])
+		except ValueError:
+			return self.send_json({"error": "start and end must be line numbers"}, 400)
+
+		with self.server.recovery_lock:
+			if url.path == "/stats":
+				data = recovery_stats(recovery_state)
+			elif url.path == "/progress":
+				data = recovery_progress(recovery_state)
+			elif url.path == "/lines":
+				data = {"start": start, "end": end, "lines": render_lines(recovery_state, start, end)}
+			elif url.path == "/pages":
+				start, end = clamp_pages(recovery_state, start, end)
+				data = {"start": start, "end": end, "lines": render_pages(recovery_state, start, end, map_char_combining)}
+			elif url.path == "/mapping":
+				data = {"map_cid_char": dict(recovery_state["map_cid_char"]), "map_cid_suggested": dict(recovery_state["map_cid_suggested"])}
+			elif url.path == "/input":
+				pending = recovery_state["pending"]
+				data = {
+					"list_queries": [query for query in list_queries if ["query", query] not in pending],
+					"list_sure_words": [sure_word for sure_word in list_sure_words if ["sure_word", sure_word] not in pending],
+					"pending": [list(source) for source in pending],
+				}
+			else:
+				data = None
+
+		if data is None:
+			return self.send_json({"error": "unknown endpoint "+url.path}, 404)
+
+		self.send_json(data)
+
+	def do_POST(self):
+		url = urlparse(self.path)
+
+		recovery_state = self.server.recovery_state
+		list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = self.server.recovery_input_data
+
+		if url.path == "/write":
+			with self.server.recovery_lock:
+				write_recovery(recovery_state, self.server.target_font, self.server.recovery_input_data, self.server.document_data)
+			return self.send_json({"written": ["recovered_text.txt", "recovered_document.txt"]})
+		elif url.path == "/queries":
+			field, kind = "queries", "query"
+		elif url.path == "/sure_words":
+			field, kind = "sure_words", "sure_word"
+		else:
+			return self.send_json({"error": "unknown endpoint "+url.path}, 404)
+
+		try:
+			length = int(self.headers.get("Content-Length", 0))
+			list_submitted = json.loads(self.rfile.read(length).decode("utf-8"))[field]
+			assert isinstance(list_submitted, list) and all([isinstance(x, str) for x in list_submitted])
+		except (ValueError, KeyError, TypeError, AssertionError):
+			return self.send_json({"error": "body must be a JSON object with a list of strings in '"+field+"'"}, 400)
+
+		if kind == "query":
+			try:
+				for submitted in list_submitted:
+					parse_query(submitted)
+			except ValueError as e:
+				return self.send_json({"error": str(e)}, 400)
+
+		map_kind_list = {"query": list_queries, "sure_word": list_sure_words}
+
+		results = []
+		with self.server.recovery_lock:
+			for submitted in list_submitted:
+				map_new, list_conflicts = apply_input(recovery_state, [kind, submitted])
+				results.append({"input": submitted, "new": map_new, "conflicts": list_conflicts})
+
+			# the inputs infering nothing yet stay pending and are tried again after each update, they are only accepted once they infer pairs
+			list_sources = [[kind, submitted] for submitted in list_submitted] + list(recovery_state["pending"])
+			map_pending_new, list_pending_conflicts = apply_pending(recovery_state)
+			for source_kind, input_data in list_sources:
+				if [source_kind, input_data] not in recovery_state["pending"] and input_data not in map_kind_list[source_kind]:
+					map_kind_list[source_kind].append(input_data)
+
+			for result in results:
+				result["pending"] = [kind, result["input"]] in recovery_state["pending"]
+			ratio = recovery_stats(recovery_state)["ratio"]
+
+		self.send_json({"results": results, "new_from_pending": map_pending_new, "ratio": ratio})
+
+
+def serve_recovery(recovery_state, recovery_input_data, target_font, document_data, host="127.0.0.1", port=8000):
+	""" creates the local recovery service over the state of a document, several annotators can then submit input data and read the recovered text without rerunning the script """
+
+	server = ThreadingHTTPServer((host, port), RecoveryRequestHandler)
+	server.recovery_state = recovery_state
+	server.recovery_input_data = recovery_input_data
+	server.target_font = target_font
+	server.document_data = document_data
+	server.recovery_lock = threading.Lock()
+
+	return server
+
+
+def final_mapping(recovery_state):
+	""" CID to character mapping of the recovery, the fixed map completing the infered mapping """
+
+	map_final = {}
+	for cid, char in recovery_state["fixed_map"].items():
+		cid = str(cid).lstrip(":")
+		if cid in recovery_state["map_cid_lines"]:
+			map_final[cid] = char
+	map_final.update(recovery_state["map_cid_char"])
+
+	return map_final
+
+
+def write_tounicode_cmap(cmap_fp, map_code_char):
+	""" writes a ToUnicode CMap mapping the character codes of the font to unicode strings.
+	pdfminer reports the codes of a simple font and the CID of an Identity-H font alike as (cid:N): the codes are assumed to be single bytes when they are all below 256 and 2 bytes (Identity-H) otherwise """
+
+	list_codes = sorted(map_code_char.items())
+
+	if all([code <= 0xFF for code in map_code_char]):
+		code_format, code_max = "<%02X>", 0xFF
+	else:
+		code_format, code_max = "<%04X>", 0xFFFF
+
+	with open(cmap_fp, "w") as f:
+		print("/CIDInit /ProcSet findresource begin", file=f)
+		print("12 dict begin", file=f)
+		print("begincmap", file=f)
+		print("/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def", file=f)
+		print("/CMapName /Adobe-Identity-UCS def", file=f)
+		print("/CMapType 2 def", file=f)
+		print("1 begincodespacerange", file=f)
+		print(code_format % 0, code_format % code_max, file=f)
+		print("endcodespacerange", file=f)
+
+		# at most 100 entries per block
+		for idx in range(0, len(list_codes), 100):
+			block = list_codes[idx:idx+100]
+			print(len(block), "beginbfchar", file=f)
+			for code, char in block:
+				print(code_format % code, "<%s>" % char.encode("utf-16-be").hex().upper(), file=f)
+			print("endbfchar", file=f)
+
+		print("endcmap", file=f)
+		print("CMapName currentdict /CMap defineresource pop", file=f)
+		print("end", file=f)
+		print("end", file=f)
+
+
+def export_recovery(recovery_state, target_font, recovery_input_data, document_data, export_dir):
+	""" exports the recovery so that it can be used without rerunning the pipeline: the mapping of the target font as a ToUnicode CMap and as JSON/TSV tables, and the recovered document as a line-aligned corpus written as a stream """
+
+	list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = recovery_input_data
+	list_lines, document_lines, map_font_alllines, map_font_allbboxes = document_data
+
+	os.makedirs(export_dir, exist_ok=True)
+
+	def combine(text):
+		for from_, to_ in map_char_combining.items():
+			text = text.replace(from_, to_)
+		return text
+
+	map_final = final_mapping(recovery_state)
+	map_cid_original = recovery_state.get("map_cid_original", {})
+
+	map_cid_count = {cid: len(list_idx) for cid, list_idx in recovery_state["map_cid_lines"].items() if cid != ""}
+
+	if recovery_state.get("space_cid") is not None:
+		space, count_space = recovery_state["space_cid"]
+		map_final[space] = " "
+		map_cid_count[space] = count_space
+
+	list_mapping = []
+	map_code_char = {}
+
+	for cid, count in sorted(map_cid_count.items(), key=lambda x: (len(x[0]), x[0])):
+		original = map_cid_original.get(cid, cid)
+		match_code = re.match(r"^\(cid:([0-9]+)\)$", original)
+		code = int(match_code.group(1)) if match_code else None
+		char = map_final.get(cid)
+		unicode = combine(char) if char is not None else None
+
+		list_mapping.append({"cid": cid, "original": original, "code": code, "char": char, "unicode": unicode, "count": count})
+		if code is not None and unicode is not None and code <= 0xFFFF:
+			map_code_char[code] = unicode
+
+	font_name = re.sub(r"[^\w.+-]", "_", target_font)
+
+	write_tounicode_cmap(os.path.join(export_dir, font_name+".cmap"), map_code_char)
+
+	with open(os.path.join(export_dir, font_name+".mapping.json"), "w") as f:
+		json.dump({"font": target_font, "mapping": list_mapping}, f, ensure_ascii=False, indent=1)
+
+	with open(os.path.join(export_dir, font_name+".mapping.tsv"), "w") as f:
+		print("cid\toriginal\tcode\tchar\tunicode\tcount", file=f)
+		for entry in list_mapping:
+			print("\t".join(["" if entry[key] is None else str(entry[key]) for key in ["cid", "original", "code", "char", "unicode", "count"]]), file=f)
+
+	decoded_lines = recovery_state["decoded_lines"]
+	map_docline_line = recovery_state["map_docline_line"]
+
+	with open(os.path.join(export_dir, "corpus.tsv"), "w") as f:
+		print("page\tline\tfont\tfont_line\ttext", file=f)
+		for idx_doc, (page, line, font, font_line, len_, text) in enumerate(document_lines):
+			if idx_doc in map_docline_line:
+				rec_line = decoded_lines[map_docline_line[idx_doc]]
+			else:
+				rec_line = "".join(text)
+			rec_line = combine(rec_line).replace("\t", " ")
+			print(page, line, font, font_line, rec_line, sep="\t", file=f)
+
+	print("exported", len(map_code_char), "codes of", target_font, "and", len(document_lines), "lines to", export_dir)
+
+
+def load_exported_mapping(mapping_fp, target_font):
+	""" reads the mapping exported by a previous run (<font>.mapping.json), returns the recovered character of each original code to start the recovery from """
+
+	with open(mapping_fp) as f:
+		data = json.load(f)
+
+	if data["font"] != target_font:
+		print("WARNING: the mapping", mapping_fp, "was exported for the font", data["font"], "not", target_font)
+
+	return {entry["original"]: entry["char"] for entry in data["mapping"] if entry["char"] is not None}
+
+
+def parse_range(text):
+	""" parses an inclusive range of line or page numbers such as 120-140 (or a single number), returns the start and the excluded end """
+
+	try:
+		start, _, end = text.partition("-")
+		start = int(start)
+		end = int(end) if end != "" else start
+	except ValueError:
+		raise argparse.ArgumentTypeError("expected a range such as 120-140")
+
+	return [start, end+1]
 
-	return status
 
 def main():
 
+	# the progress is recorded once per session, identified by its start time and process
+	session = "%s-%d" % (time.strftime("%Y-%m-%dT%H:%M:%S"), os.getpid())
+
 	# READ DOCUMENT
 
 	print("==== STEP 1: Read PDF2XML output of the document to recover")
 
-	if len(sys.argv) != 2:
-		print("usage:", sys.argv[0], "file.xml")
-		sys.exit(1)
+	parser = argparse.ArgumentParser(description="interactive recovery of the text associated to a specific font in a corrupted PDF document")
+	parser.add_argument("xml_fp", metavar="file.xml", help="output of pdf2txt.py -t xml on the corrupted PDF")
+	parser.add_argument("--layout", action="store_true", help="separate the words of the target font using the gaps between the glyphs instead of guessing the space CID")
+	parser.add_argument("--lines", type=parse_range, metavar="START-END", default=None, help="print only this range of lines of the recovered text (numbered as in recovered_text.txt)")
+	parser.add_argument("--pages", type=parse_range, metavar="START-END", default=None, help="print only this range of pages of the recovered document (numbered from 0 as in document_raw.csv)")
+	parser.add_argument("--no-files", action="store_true", help="do not print the whole recovered text nor regenerate recovered_text.txt and recovered_document.txt")
+	parser.add_argument("--export", metavar="DIR", default=None, help="export the mapping of the target font (ToUnicode CMap, JSON and TSV tables) and the line-aligned recovered corpus to DIR")
+	parser.add_argument("--input", metavar="input.json", default=None, help="JSON file holding the recovery input data, instead of the variables of the script")
+	parser.add_argument("--mapping", metavar="FONT.mapping.json", default=None, help="start the recovery from the mapping exported by a previous run with --export")
+	mode = parser.add_mutually_exclusive_group()
+	mode.add_argument("--serve", type=int, metavar="PORT", default=None, help="after the recovery, serve the document and the mapping on localhost:PORT for several annotators")
+	mode.add_argument("--watch", action="store_true", help="after the recovery, watch the input file and update the recovery on each change")
+	args = parser.parse_args()
+
+	if args.watch and args.input is None:
+		parser.error("--watch requires --input")
 
 	try:
-		xml_fp = sys.argv[1]
+		xml_fp = args.xml_fp
 		xml_data = open(xml_fp).read()
 
 		document_data = process_document_xml(xml_data)
@@ -747,7 +2005,7 @@ def main():
 		sys.exit(1)
 
 
-	list_lines, document_lines, map_font_alllines = document_data
+	list_lines, document_lines, map_font_alllines, map_font_allbboxes = document_data
 
 	# RECOVERY INPUT DATA
 
@@ -757,6 +2015,7 @@ def main():
 	map_char_combining = {}
 	fixed_map = {}
 	target_font = None
+	reference_wordlist = None
 
 	### example of input data for recoveering the UDHR in Nivkh (iso:niv) (https://www.ohchr.org/sites/default/files/UDHR/Documents/UDHR_Translations/Nivkh.pdf)
 	#list_queries = ["221=>ӿымди қ`оӻл уйгид", "Ниғвӊ дуфтоӿ вылӊуд Санги", "Нивӊ қ`атьгун ӿара, чуғун ӿара сик намадивӊчоғҏ", "Организация Объединенных Наций цельғундоӿ ёскиндфурнд", "эна положенияяғун ивӻай напы п`ӿатьӿать қаврна, п`ӊафқ-ӊафқ", "самоуправляющаяся ӿа ӷаврд лу,", "Генеральная Ассамблея туӊ сик", "Декларация задача ӿагун провозглашайдра", "Чу п`ӿоӻара, сикак маӊра ӿаӊ общество"]
@@ -764,9 +2023,14 @@ def main():
 	#map_char_combining = {"ҏ": "р̌", "Ҏ": "Р̌"}
 	#fixed_map = {}
 	#target_font = "OTOUXR+HeliosNivkh"
+	#reference_wordlist = "niv_wordlist.txt"
 
 	#
-	recovery_input_data = [list_queries, map_char_combining, list_sure_words, fixed_map]
+	recovery_input_data = [list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist]
+
+	if args.input is not None:
+		recovery_input_data, target_font = load_recovery_input(args.input)
+		list_queries, map_char_combining, list_sure_words, fixed_map, reference_wordlist = recovery_input_data
 
 	# FONT SELECTION
 
@@ -792,9 +2056,9 @@ def main():
 	# RECOVERY
 
 	print("==== STEP 3: specify input data to start the recovery process")
-	no_data = len(list_queries) + len(list_sure_words) + len(fixed_map) == 0
+	no_data = len(list_queries) + len(list_sure_words) + len(fixed_map) == 0 and args.mapping is None
 
-	if no_data:
+	if no_data and not args.watch:
 		print("WARNING: no input data")
 		sys.exit(1)
 	else:
@@ -802,7 +2066,12 @@ def main():
 		print(recovery_input_data)
 
 	print("==== STEP 4: Automatic font recovery based on input data")
-	status = process_font(target_font, recovery_input_data, document_data, force_cid=True, keep_punctuation=False)
+	map_original_char = None
+	if args.mapping is not None:
+		map_original_char = load_exported_mapping(args.mapping, target_font)
+		print("starting from", len(map_original_char), "characters of", args.mapping)
+
+	status, recovery_state = process_font(target_font, recovery_input_data, document_data, force_cid=True, keep_punctuation=False, write_files=not args.no_files, use_layout=args.layout, map_original_char=map_original_char)
 
 	print(map_font_alllines.keys())
 	
@@ -813,5 +2082,33 @@ def main():
 	else:
 		print("recovery not completed")
 
+	summary = recovery_progress(recovery_state)
+	print_progress(summary, record_progress(summary, xml_fp, target_font, session))
+
+	print_ranges(recovery_state, recovery_input_data, args.lines, args.pages)
+
+	if args.export is not None:
+		export_recovery(recovery_state, target_font, recovery_input_data, document_data, args.export)
+
+	if args.serve is not None:
+		print("==== STEP 6: Serving the recovery of the document on http://127.0.0.1:%d" % args.serve)
+		server = serve_recovery(recovery_state, recovery_input_data, target_font, document_data, port=args.serve)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		server.server_close()
+
+		# the record of the session is updated with the progress made through the service
+		summary = recovery_progress(recovery_state)
+		print_progress(summary, record_progress(summary, xml_fp, target_font, session))
+
+	if args.watch:
+		print("==== STEP 6: Watching", args.input, "for changes of the input data")
+		try:
+			watch_recovery(args.input, recovery_state, recovery_input_data, target_font, xml_fp, document_data, not args.no_files, args.lines, args.pages, session=session)
+		except KeyboardInterrupt:
+			pass
+
 if __name__ == "__main__":
 	main()
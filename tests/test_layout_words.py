@@ -0,0 +1,50 @@
+""" tests of the word separation from the geometry of the glyphs """
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import recover_text
+
+
+def layout_line(words, width=10., space=4., overlap=None):
+	""" boxes of the glyphs of a line of 10pt glyphs, the glyph of index overlap is moved back by 3pt over the previous one """
+
+	line, bboxes = [], []
+	x = 0.
+	for word in words:
+		for char in word:
+			if overlap is not None and len(line) == overlap:
+				x -= 3.
+			line.append(char)
+			bboxes.append([x, 0., x + width, 10.])
+			x += width
+		x += space
+
+	return line, bboxes
+
+
+class LayoutWordsTest(unittest.TestCase):
+
+	def test_touching_glyphs(self):
+		line, bboxes = layout_line(["abc", "def"])
+		self.assertEqual(recover_text.layout_words(line, bboxes), [["a", "b", "c"], ["d", "e", "f"]])
+
+	def test_overlapping_glyph(self):
+		line, bboxes = layout_line(["abc", "def"], overlap=2)
+		self.assertEqual(recover_text.layout_words(line, bboxes), [["a", "b", "c"], ["d", "e", "f"]])
+
+	def test_no_gap(self):
+		line, bboxes = layout_line(["abcdef"])
+		self.assertEqual(recover_text.layout_words(line, bboxes), [["a", "b", "c", "d", "e", "f"]])
+
+	def test_out_of_order_and_spaces(self):
+		line, bboxes = layout_line(["ab", "cd"])
+		line, bboxes = line[::-1] + [" "], bboxes[::-1] + [None]
+		self.assertEqual(recover_text.layout_words(line, bboxes), [["a", "b"], ["c", "d"]])
+
+
+if __name__ == "__main__":
+	unittest.main()
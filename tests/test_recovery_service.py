@@ -0,0 +1,111 @@
+""" offline tests of the recovery service against localhost """
+
+import json
+import os
+import sys
+import threading
+import unittest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import recover_text
+
+
+TEXT = ["the cat sat", "a dog ran", "the dog sat"]
+
+
+def build_document():
+	""" encodes a short text with one CID per character, as the worded lines of a corrupted font """
+
+	map_char_cid = {char: str(idx) for idx, char in enumerate(sorted(set("".join(TEXT)) - set(" ")))}
+	lines = [[":".join([map_char_cid[char] for char in word]) for word in line.split()] for line in TEXT]
+
+	document_lines = [[0, idx, "XYZ+Corrupt", idx+1, len(line), line] for idx, line in enumerate(TEXT)]
+	document_data = [[], document_lines, {}, {}]
+
+	recovery_state = recover_text.build_recovery_state(lines, {}, {})
+	recover_text.index_document(recovery_state, document_data, "XYZ+Corrupt")
+
+	return recovery_state, document_data
+
+
+class RecoveryServiceTest(unittest.TestCase):
+
+	def setUp(self):
+		recovery_state, document_data = build_document()
+		recovery_input_data = [[], {}, [], {}, None]
+
+		self.server = recover_text.serve_recovery(recovery_state, recovery_input_data, "XYZ+Corrupt", document_data, port=0)
+		self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.thread.join()
+
+	def get(self, path):
+		with urlopen(self.url + path) as response:
+			return json.loads(response.read().decode("utf-8"))
+
+	def post(self, path, data):
+		request = Request(self.url + path, data=json.dumps(data).encode("utf-8"), headers={"Content-Type": "application/json"})
+		with urlopen(request) as response:
+			return json.loads(response.read().decode("utf-8"))
+
+	def test_round_trip(self):
+		self.assertEqual(self.get("/stats")["decoded_cid"], 0)
+
+		# the page range is restricted to the pages of the document
+		answer = self.get("/pages?start=0&end=30000000")
+		self.assertEqual([answer["start"], answer["end"], len(answer["lines"])], [0, 1, len(TEXT)])
+
+		# every three letter word matches the sure word while nothing is decoded
+		answer = self.post("/sure_words", {"sure_words": ["dog"]})
+		self.assertTrue(answer["results"][0]["pending"])
+		self.assertEqual(self.get("/input"), {"list_queries": [], "list_sure_words": [], "pending": [["sure_word", "dog"]]})
+
+		answer = self.post("/queries", {"queries": ["1=>a dog ran"]})
+		self.assertFalse(answer["results"][0]["pending"])
+		self.assertEqual(self.get("/input"), {"list_queries": ["1=>a dog ran"], "list_sure_words": ["dog"], "pending": []})
+		self.assertEqual(self.get("/lines?start=1&end=2")["lines"], ["l.0001:\ta dog ran"])
+
+		# a query inconsistent with the mapping is not accepted
+		answer = self.post("/queries", {"queries": ["1=>a cat ran"]})
+		self.assertNotEqual(answer["results"][0]["conflicts"], [])
+		self.assertEqual(self.get("/input")["list_queries"], ["1=>a dog ran"])
+		self.assertEqual(self.get("/input")["pending"], [["query", "1=>a cat ran"]])
+
+	def test_invalid_line_cue(self):
+		for query in ["x=>a dog ran", "1=>a dog=>ran"]:
+			request = Request(self.url + "/queries", data=json.dumps({"queries": [query]}).encode("utf-8"))
+			with self.assertRaises(HTTPError) as context:
+				urlopen(request)
+			self.assertEqual(context.exception.code, 400)
+			self.assertIn("error", json.loads(context.exception.read().decode("utf-8")))
+
+		# the service is still up and nothing was recorded
+		self.assertEqual(self.get("/input"), {"list_queries": [], "list_sure_words": [], "pending": []})
+
+	def test_concurrent_posts(self):
+		list_answers = []
+		list_threads = [threading.Thread(target=lambda query: list_answers.append(self.post("/queries", {"queries": [query]})), args=(query,)) for query in ["0=>the cat sat", "1=>a dog ran"]]
+		for thread in list_threads:
+			thread.start()
+		for thread in list_threads:
+			thread.join()
+
+		self.assertEqual(len(list_answers), 2)
+		self.assertTrue(all([answer["results"][0]["conflicts"] == [] for answer in list_answers]))
+		self.assertEqual(sorted(self.get("/input")["list_queries"]), ["0=>the cat sat", "1=>a dog ran"])
+
+		stats = self.get("/stats")
+		self.assertEqual(stats["ratio"], 1.)
+		self.assertEqual(self.get("/lines?start=0&end=3")["lines"], ["l.%04d:\t%s" % (idx, line) for idx, line in enumerate(TEXT)])
+
+
+if __name__ == "__main__":
+	unittest.main()
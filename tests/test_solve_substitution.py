@@ -0,0 +1,91 @@
+""" deterministic tests of the automatic substitution solver on a toy cipher """
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import recover_text
+
+
+TEXT = """the quick brown fox jumps over the lazy dog . the dog sleeps in the sun while the fox runs into the woods .
+a farmer walks to the barn with his dog and the fox hides behind the old tree near the river .
+the children play in the garden and the birds sing in the trees while the sun shines over the hills .
+the old man reads a book by the fire and his wife makes bread for the children in the kitchen ."""
+
+SOLVER_ARGS = {"restarts": 4, "iterations": 3000, "processes": 1}
+
+
+def encode_text():
+	""" encodes the toy text with one CID per character, returns the worded lines and the CID of each character """
+
+	map_char_cid = {char: str(idx) for idx, char in enumerate(sorted(set(TEXT) - set(" \n")))}
+	lines = [[":".join([map_char_cid[char] for char in word]) for word in line.split()] for line in TEXT.split("\n")]
+
+	return lines, map_char_cid
+
+
+class NgramModelTest(unittest.TestCase):
+
+	def test_normalised(self):
+		alphabet = [" ", "a", "b", "c"]
+		log_probs = recover_text.build_ngram_model(["abc", "cab", "ba"], alphabet, n=3)
+		self.assertEqual(log_probs.shape, (4, 4, 4))
+		np.testing.assert_allclose(np.exp(log_probs).sum(axis=-1), 1.)
+
+
+class SolveSubstitutionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.lines, self.map_char_cid = encode_text()
+		self.reference_words = TEXT.split()
+
+		self.map_cid_char = {self.map_char_cid["."]: ".", self.map_char_cid["e"]: "e"}
+		self.fixed_map = {":" + self.map_char_cid["t"]: "t"}
+
+	def solve(self, **kwargs):
+		args = dict(SOLVER_ARGS)
+		args.update(kwargs)
+		return recover_text.solve_substitution(self.lines, self.map_cid_char, self.fixed_map, self.reference_words, **args)
+
+	def test_constraints(self):
+		map_solved = self.solve()
+
+		# the known CID and the fixed map are kept, and their characters are not given to another CID
+		self.assertNotIn(self.map_char_cid["."], map_solved)
+		self.assertNotIn(self.map_char_cid["e"], map_solved)
+		self.assertNotIn(self.map_char_cid["t"], map_solved)
+		self.assertEqual(self.map_cid_char, {self.map_char_cid["."]: ".", self.map_char_cid["e"]: "e"})
+		self.assertTrue(set(map_solved.values()).isdisjoint([".", "e", "t"]))
+
+		# no character is assigned twice
+		self.assertEqual(len(set(map_solved.values())), len(map_solved))
+
+	def test_deterministic(self):
+		self.assertEqual(self.solve(), self.solve())
+
+	def test_guesses(self):
+		map_solved = self.solve()
+		map_cid_truth = {cid: char for char, cid in self.map_char_cid.items()}
+
+		self.assertGreater(len(map_solved), 0)
+		count_correct = sum([map_cid_truth[cid] == char for cid, char in map_solved.items()])
+		self.assertGreaterEqual(count_correct, 0.8 * len(map_solved))
+
+	def test_low_agreement_left_out(self):
+		# no guess can be found by more than all the restarts, nor gain that much over the unknown character
+		self.assertEqual(self.solve(min_agreement=1.01), {})
+		self.assertEqual(self.solve(min_gain=1e6), {})
+
+	def test_small_wordlist(self):
+		# with a few words most CID have no confident guess and stay undecoded
+		map_solved = recover_text.solve_substitution(self.lines, self.map_cid_char, self.fixed_map, ["farmer", "big", "the"], **SOLVER_ARGS)
+		self.assertLess(len(map_solved), len(set(TEXT) - set(" \n.et")) // 2)
+		self.assertEqual(len(set(map_solved.values())), len(map_solved))
+
+
+if __name__ == "__main__":
+	unittest.main()